@@ -0,0 +1,362 @@
+"""Benchmarks for the typeahead search implementation.
+
+Usage: python benchmark.py <benchmark> [<benchmark> ...]
+Run with no arguments to list the available benchmarks.
+"""
+import os
+import sys
+import random
+import string
+import tempfile
+import subprocess
+from bisect import bisect
+from timeit import default_timer
+
+from search import TypeAheadRadixTrie, TypeAheadSearchSession
+
+
+TYPES = ('user', 'topic', 'question', 'board')
+
+
+def vocabulary(size, seed=0):
+    """Return a list of `size` distinct random lowercase words."""
+    rng = random.Random(seed)
+    words = set()
+    while len(words) < size:
+        words.add(''.join(
+            rng.choice(string.ascii_lowercase)
+            for i in range(rng.randint(3, 10))
+        ))
+    return sorted(words)
+
+
+def corpus(num_entries, vocab, words_per_entry=5, skew=0, types=TYPES,
+           seed=0):
+    """Return a list of ADD commands drawing words from vocab.
+    If skew is nonzero, word frequencies follow a Zipf distribution with
+    that exponent, in vocab order.
+    Types are drawn uniformly from types; repeat a type to weight it.
+    """
+    rng = random.Random(seed)
+    cumulative = []
+    total = 0.0
+    for rank in range(len(vocab)):
+        total += 1.0 / (rank + 1) ** skew
+        cumulative.append(total)
+
+    def word():
+        return vocab[bisect(cumulative, rng.random() * total)]
+
+    return [
+        'ADD {} {}{} {:.3f} {}'.format(
+            rng.choice(types), 'e', i, rng.random(),
+            ' '.join(word() for j in range(words_per_entry))
+        )
+        for i in range(num_entries)
+    ]
+
+
+def load(commands, session=None):
+    """Run commands against session (a new one by default) and return it."""
+    if session is None:
+        session = TypeAheadSearchSession()
+    for command in commands:
+        session.run_command(command)
+    return session
+
+
+def timed(function, *args):
+    """Return the wall time, in seconds, of calling function(*args)."""
+    start = default_timer()
+    function(*args)
+    return default_timer() - start
+
+
+def typo(word, edits, rng):
+    """Return word with `edits` random single letter substitutions."""
+    word = list(word)
+    for i in rng.sample(range(len(word)), min(edits, len(word))):
+        word[i] = rng.choice(string.ascii_lowercase)
+    return ''.join(word)
+
+
+def bench_fuzzy():
+    """Fuzzy search latency by edit distance and corpus size."""
+    rng = random.Random(1)
+    print '{:>8} {:>5} {:>10} {:>10} {:>10}'.format(
+        'entries', 'edits', 'mean ms', 'max ms', 'budget ms'
+    )
+    for num_entries in (1000, 10000, 50000):
+        vocab = vocabulary(num_entries // 2)
+        trie = load(corpus(num_entries, vocab)).trie
+        queries = [rng.choice(vocab)[:5] for i in range(200)]
+        for edits in (0, 1, 2):
+            typos = [typo(query, edits, rng) for query in queries]
+            times = [
+                timed(trie.fuzzy_search, query, edits)
+                for query in typos
+            ]
+            budget_times = [
+                timed(trie.fuzzy_search, query, edits, 2000)
+                for query in typos
+            ]
+            print '{:>8} {:>5} {:>10.3f} {:>10.3f} {:>10.3f}'.format(
+                num_entries, edits,
+                1000 * sum(times) / len(times), 1000 * max(times),
+                1000 * max(budget_times)
+            )
+
+
+def bench_top_k():
+    """Short single word QUERY latency with and without best lists."""
+    rng = random.Random(2)
+    vocab = vocabulary(5000)
+    commands = corpus(50000, vocab)
+    queries = [
+        'QUERY {} {}'.format(rng.randint(1, 20), rng.choice(vocab)[:2])
+        for i in range(2000)
+    ]
+    print '{:>6} {:>10} {:>10}'.format('top_k', 'load s', 'query ms')
+    for top_k in (0, 20):
+        session = TypeAheadSearchSession(top_k=top_k)
+        load_time = timed(load, commands, session)
+        query_time = timed(load, queries, session)
+        print '{:>6} {:>10.2f} {:>10.3f}'.format(
+            top_k, load_time, 1000 * query_time / len(queries)
+        )
+
+
+def first_answer(options, arguments, commands):
+    """Return the wall time from starting run_search.py with the given
+    interpreter options and arguments until it answers its first query.
+    """
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'run_search.py')
+    start = default_timer()
+    process = subprocess.Popen(
+        [sys.executable] + options + [script] + arguments,
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE
+    )
+    process.stdin.write('{}\n{}\n'.format(
+        len(commands), '\n'.join(commands)
+    ))
+    process.stdin.close()
+    process.stdout.readline()
+    elapsed = default_timer() - start
+    process.wait()
+    return elapsed
+
+
+def bench_startup():
+    """Time to the first answered query, cold and from a snapshot."""
+    vocab = vocabulary(5000)
+    print '{:>8} {:>12} {:>12} {:>12}'.format(
+        'entries', 'cold s', 'snapshot s', 'snapshot -S'
+    )
+    for num_entries in (0, 10000, 50000):
+        commands = corpus(num_entries, vocab)
+        query = 'QUERY 10 {}'.format(vocab[0][:2])
+
+        fd, path = tempfile.mkstemp()
+        try:
+            with os.fdopen(fd, 'wb') as snapshot:
+                load(commands).dump(snapshot)
+            print '{:>8} {:>12.3f} {:>12.3f} {:>12.3f}'.format(
+                num_entries,
+                first_answer([], [], commands + [query]),
+                first_answer([], [path], [query]),
+                first_answer(['-S'], [path], [query])
+            )
+        finally:
+            os.remove(path)
+
+
+def spill_run(num_entries, cache_bytes, spill_size):
+    """Load a skewed corpus, spilling to disk if cache_bytes isn't None,
+    and print the load time, mean query time and peak RSS, and the size
+    of the spill file before and after deleting half the entries.
+    """
+    import resource
+    from postings import PostingStore
+
+    store = None
+    if cache_bytes is not None:
+        store = PostingStore(cache_bytes=cache_bytes, spill_size=spill_size)
+    session = TypeAheadSearchSession(store=store)
+
+    def file_size():
+        if store is None:
+            return 0
+        store.file.seek(0, 2)
+        return store.file.tell() / float(1 << 20)
+
+    rng = random.Random(3)
+    vocab = vocabulary(5000)
+    queries = [
+        'QUERY 10 {}'.format(' '.join(
+            rng.choice(vocab)[:rng.randint(2, 4)] for j in range(2)
+        ))
+        for i in range(500)
+    ]
+    commands = corpus(num_entries, vocab, words_per_entry=8, skew=1)
+    load_time = timed(load, commands, session)
+    query_time = timed(load, queries, session)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+    loaded_size = file_size()
+    load(['DEL e{}'.format(i) for i in range(0, num_entries, 2)], session)
+    row = '{:>8} {:>12} {:>10} {:>8.2f} {:>9.3f} {:>8} {:>8.1f} {:>8.1f}'
+    print row.format(
+        num_entries, cache_bytes, spill_size, load_time,
+        1000 * query_time / len(queries), peak, loaded_size, file_size()
+    )
+
+
+def bench_spill():
+    """Load time, query time, peak RSS and spill file size."""
+    print '{:>8} {:>12} {:>10} {:>8} {:>9} {:>8} {:>8} {:>8}'.format(
+        'entries', 'cache bytes', 'spill size', 'load s', 'query ms',
+        'peak MB', 'file MB', 'DEL MB'
+    )
+    # Each run gets its own process, so that peak RSS is its own.
+    for num_entries in (20000, 50000):
+        for cache_bytes, spill_size in ((None, None), (64 << 20, 1024),
+                                        (8 << 20, 1024), (8 << 20, 256)):
+            sys.stdout.flush()
+            subprocess.check_call([
+                sys.executable, '-c',
+                'import benchmark; benchmark.spill_run({}, {}, {})'.format(
+                    num_entries, cache_bytes, spill_size
+                )
+            ], cwd=os.path.dirname(os.path.abspath(__file__)))
+
+
+def in_order_intersection(trie, search_words):
+    """Intersect results sets in the order given, as _query_base once did.
+    For comparison.
+    """
+    results = set(trie.search(search_words[0]))
+    for word in search_words[1:]:
+        results &= trie.search(word)
+    return results
+
+
+def bench_intersect():
+    """Multi word intersection with skewed word frequencies."""
+    rng = random.Random(4)
+    vocab = vocabulary(5000)
+    trie = TypeAheadRadixTrie()
+    for command in corpus(50000, vocab, words_per_entry=8, skew=1):
+        add, type, id, score, data = command.split(None, 4)
+        for word in data.split():
+            trie.add(word, id)
+
+    # Words are drawn with Zipf frequencies in vocab order, so the first
+    # few are very common and the last few rare.
+    common, rare = vocab[:5], vocab[-1000:]
+    cases = (
+        ('common rare', lambda: (rng.choice(common), rng.choice(rare))),
+        ('rare common', lambda: (rng.choice(rare), rng.choice(common))),
+        ('common common', lambda: tuple(rng.sample(common, 2))),
+        ('common x3 rare', lambda: tuple(rng.sample(common, 3)) + (
+            rng.choice(rare),
+        )),
+    )
+    print '{:<16} {:>12} {:>12}'.format('words', 'in order ms', 'planned ms')
+    for name, words in cases:
+        queries = [words() for i in range(500)]
+        in_order = timed(
+            lambda: [in_order_intersection(trie, q) for q in queries]
+        )
+        planned = timed(lambda: [trie.search_all(q) for q in queries])
+        print '{:<16} {:>12.4f} {:>12.4f}'.format(
+            name, 1000 * in_order / len(queries),
+            1000 * planned / len(queries)
+        )
+
+
+def types_run(partition_types):
+    """Load a type skewed corpus, with or without a Trie per type, and
+    print the load time, peak RSS and mean time of untyped and typed
+    queries.
+    """
+    import resource
+
+    rng = random.Random(5)
+    vocab = vocabulary(2000)
+    types = ('question',) * 85 + ('user',) * 10 + ('topic',) * 4 + ('board',)
+    commands = corpus(50000, vocab, words_per_entry=8, skew=1, types=types)
+    session = TypeAheadSearchSession(partition_types=partition_types)
+    load_time = timed(load, commands, session)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+
+    queries = [
+        [rng.choice(vocab)[:rng.randint(1, 3)]] for i in range(300)
+    ]
+    times = []
+    for wanted in (None, ['board'], ['topic', 'board'], ['question']):
+        elapsed = timed(lambda: [
+            session._query(10, q, wanted) for q in queries
+        ])
+        times.append(1000 * elapsed / len(queries))
+    print '{:<12} {:>7.2f} {:>8} {:>8.3f} {:>8.3f} {:>8.3f} {:>8.3f}'.format(
+        'per type' if partition_types else 'single', load_time, peak, *times
+    )
+
+
+def bench_types():
+    """Load, peak RSS and query cost with and without a Trie per type."""
+    print '{:<12} {:>7} {:>8} {:>8} {:>8} {:>8} {:>8}'.format(
+        'tries', 'load s', 'peak MB', 'all ms', 'b ms', 't,b ms', 'q ms'
+    )
+    # Each run gets its own process, so that peak RSS is its own.
+    for partition_types in (False, True):
+        sys.stdout.flush()
+        subprocess.check_call([
+            sys.executable, '-c',
+            'import benchmark; benchmark.types_run({})'.format(
+                partition_types
+            )
+        ], cwd=os.path.dirname(os.path.abspath(__file__)))
+
+
+def bench_ingest():
+    """Bulk ingestion throughput by worker count."""
+    from ingest import ingest
+
+    commands = corpus(50000, vocabulary(5000), words_per_entry=8)
+    print '{:<10} {:>8} {:>12}'.format('workers', 'count', 'adds/s')
+    for processes in (False, True):
+        for workers in (0, 1, 2, 4):
+            if processes and not workers:
+                continue
+            elapsed = timed(
+                ingest, TypeAheadSearchSession(), commands, workers,
+                processes
+            )
+            print '{:<10} {:>8} {:>12.0f}'.format(
+                'processes' if processes else 'threads', workers,
+                len(commands) / elapsed
+            )
+
+
+BENCHMARKS = {
+    'fuzzy': bench_fuzzy,
+    'ingest': bench_ingest,
+    'intersect': bench_intersect,
+    'spill': bench_spill,
+    'startup': bench_startup,
+    'top_k': bench_top_k,
+    'types': bench_types,
+}
+
+
+def main(names):
+    if not names:
+        for name in sorted(BENCHMARKS):
+            print '{:<12} {}'.format(name, BENCHMARKS[name].__doc__)
+    for name in names:
+        BENCHMARKS[name]()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
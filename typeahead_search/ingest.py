@@ -0,0 +1,98 @@
+"""Bulk ingestion of search commands.
+
+ADD commands are parsed and tokenized by a pool of worker threads or
+processes, while the calling thread applies every command to the session
+in its original order, so that entries are numbered as if run serially.
+"""
+from collections import deque
+
+from search import TypeAheadSearchSession
+
+
+def parse_chunk(commands):
+    """Parse the ADD commands in a list of commands.
+    Returns a list with a (True, parsed) pair for each ADD, where parsed
+    is the result of TypeAheadSearchSession.parse_add, and a (False,
+    command) pair for each other command.
+    Commands are stripped, as main strips the lines it reads, and blank
+    ones are skipped.
+    """
+    parsed = []
+    for command in commands:
+        command = command.strip()
+        if not command:
+            continue
+        command_type, arguments = command.split(None, 1)
+        if command_type == 'ADD':
+            parsed.append(
+                (True, TypeAheadSearchSession.parse_add(arguments))
+            )
+        else:
+            parsed.append((False, command))
+    return parsed
+
+
+def chunks(commands, chunk_size):
+    """Yield successive lists of up to chunk_size commands."""
+    chunk = []
+    for command in commands:
+        chunk.append(command)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def ingest(session, commands, workers=0, processes=False, chunk_size=1000,
+           max_pending=None):
+    """Run an iterable of commands against session.
+    commands may be the lines of a file, newlines and all, but not the
+    count of commands that leads search.py's input; skip that line first,
+    e.g. with next(file).
+    ADD commands are parsed by `workers` worker threads, or processes if
+    processes is True; with no workers, everything runs in this thread.
+    At most max_pending chunks of chunk_size commands (by default, two
+    per worker) are parsed ahead of the one being applied.
+    Returns a list of the results of the commands that had any.
+    """
+    results = []
+
+    def apply(parsed):
+        for is_add, command in parsed:
+            if is_add:
+                session.add_parsed(command)
+            else:
+                result = session.run_command(command)
+                if result is not None:
+                    results.append(result)
+
+    if not workers:
+        for chunk in chunks(commands, chunk_size):
+            apply(parse_chunk(chunk))
+        return results
+
+    if processes:
+        from multiprocessing import Pool
+    else:
+        from multiprocessing.dummy import Pool
+    if max_pending is None:
+        max_pending = 2 * workers
+
+    pool = Pool(workers)
+    try:
+        # Chunks handed to the pool, oldest first. Applying them in this
+        # order keeps the commands in their original order.
+        pending = deque()
+        for chunk in chunks(commands, chunk_size):
+            pending.append(pool.apply_async(parse_chunk, (chunk,)))
+            if len(pending) >= max_pending:
+                apply(pending.popleft().get())
+        while pending:
+            apply(pending.popleft().get())
+    finally:
+        # Every chunk has been fetched by now, unless something failed.
+        pool.terminate()
+        pool.join()
+
+    return results
@@ -0,0 +1,291 @@
+"""On-disk storage for large TypeAheadRadixTrie posting sets.
+
+A PostingStore keeps runs of sorted data entry ids in a file, and a
+SpilledPostings stands in for a node's set of entries, holding one such
+run plus the ids added and removed since it was written. Runs no longer
+held by any SpilledPostings are dead, and their space is reclaimed once
+it outgrows the live runs.
+"""
+import sys
+import tempfile
+from collections import OrderedDict
+
+
+class PostingStore(object):
+    """A file of sorted id runs, with an LRU cache of runs read back from
+    it. Runs are appended, and the file is compacted in place once dead
+    runs take up more of it than live ones.
+    """
+
+    def __init__(self, path=None, cache_bytes=64 << 20, spill_size=1024):
+        """Create a new PostingStore.
+        If path is None, use an anonymous temporary file.
+        cache_bytes bounds the memory used by cached runs.
+        Posting sets larger than spill_size ids are spilled to the store.
+        """
+        if path is None:
+            self.file = tempfile.TemporaryFile()
+        else:
+            self.file = open(path, 'w+b')
+        self.cache_bytes = cache_bytes
+        self.spill_size = spill_size
+
+        # The (offset, length) of each run in the file, keyed by run
+        # number, which stays the same when the file is compacted. The
+        # number of SpilledPostings holding each run, by run number.
+        self.runs = {}
+        self.refs = {}
+        self.next_run = 0
+
+        # Bytes of the file used by live runs, and by dead ones.
+        self.live_bytes = 0
+        self.dead_bytes = 0
+
+        # Runs read back from the file, keyed by run number, least recently
+        # used first, and their total size in memory.
+        self.cache = OrderedDict()
+        self.cached_bytes = 0
+
+    def __getstate__(self):
+        """Refuse to be pickled. The runs live in a file that a pickle
+        can't carry, so a copy would fail on its first cache miss.
+        """
+        raise TypeError(
+            "PostingStore can't be pickled; its runs are in an open file."
+        )
+
+    def close(self):
+        """Close the underlying file."""
+        self.cache.clear()
+        self.cached_bytes = 0
+        self.file.close()
+
+    def spill(self, ids):
+        """Return a SpilledPostings holding the given ids."""
+        return SpilledPostings(self, self.write(ids), bloom_filter(ids))
+
+    def write(self, ids):
+        """Append a run of the given ids to the file.
+        Returns the run as (number, length, count).
+        """
+        data = '\n'.join(sorted(ids))
+        self.file.seek(0, 2)
+        number = self.next_run
+        self.next_run += 1
+        self.runs[number] = self.file.tell(), len(data)
+        self.live_bytes += len(data)
+        self.file.write(data)
+        self._cache(number, frozenset(ids))
+        return number, len(data), len(ids)
+
+    def read(self, run):
+        """Return the frozenset of ids in a run written by write."""
+        number, length, count = run
+        ids = self.cache.pop(number, None)
+        if ids is None:
+            self.file.seek(self.runs[number][0])
+            data = self.file.read(length)
+            # Intern ids so that runs share them with the rest of the
+            # session rather than holding copies.
+            ids = frozenset(map(intern, data.split('\n')) if count else ())
+            self._cache(number, ids)
+        else:
+            # Move the run to the most recently used end.
+            self.cache[number] = ids
+        return ids
+
+    def acquire(self, run):
+        """Count a new holder of a run."""
+        self.refs[run[0]] = self.refs.get(run[0], 0) + 1
+
+    def release(self, run):
+        """Count a holder of a run letting go of it. Once a run has no
+        holders left it is dead, and its space in the file is reclaimed
+        when dead runs outgrow live ones.
+        """
+        if self.file.closed:
+            return
+        number = run[0]
+        self.refs[number] -= 1
+        if not self.refs[number]:
+            del self.refs[number]
+            offset, length = self.runs.pop(number)
+            self.live_bytes -= length
+            self.dead_bytes += length
+            self.forget(run)
+            if self.dead_bytes > self.live_bytes:
+                self._reclaim()
+
+    def forget(self, run):
+        """Drop a run from the cache, if it's there."""
+        ids = self.cache.pop(run[0], None)
+        if ids is not None:
+            self.cached_bytes -= self._size(ids)
+
+    def _reclaim(self):
+        """Move the live runs to the front of the file, in order, and cut
+        off the rest. Each run only moves towards the front, so runs are
+        never overwritten before they are moved.
+        """
+        end = 0
+        for offset, length, number in sorted(
+            (offset, length, number)
+            for number, (offset, length) in self.runs.iteritems()
+        ):
+            if offset != end:
+                self.file.seek(offset)
+                data = self.file.read(length)
+                self.file.seek(end)
+                self.file.write(data)
+                self.runs[number] = end, length
+            end += length
+        self.file.truncate(end)
+        self.dead_bytes = 0
+
+    def _cache(self, number, ids):
+        """Add a run to the cache, evicting the least recently used runs
+        until the cache fits its budget again. The newest run is always
+        kept, even if it alone exceeds the budget.
+        """
+        self.cache[number] = ids
+        self.cached_bytes += self._size(ids)
+        while self.cached_bytes > self.cache_bytes and len(self.cache) > 1:
+            old_number, old_ids = self.cache.popitem(last=False)
+            self.cached_bytes -= self._size(old_ids)
+
+    @staticmethod
+    def _size(ids):
+        """Estimate the memory used by a cached run, in bytes.
+        The ids themselves are interned and shared, so only the set counts.
+        """
+        return sys.getsizeof(ids)
+
+
+def bloom_filter(ids):
+    """Return a Bloom filter of the given ids, for use with bloom_contains.
+    It uses about a byte per id and has a false positive rate of about 3%.
+    """
+    bits = bytearray(max(8, len(ids)))
+    size = len(bits) * 8
+    for id in ids:
+        h = hash(id)
+        for probe in (h, h >> 21, h >> 42):
+            i = probe % size
+            bits[i >> 3] |= 1 << (i & 7)
+    return bits
+
+
+def bloom_contains(bits, id):
+    """Return False if id is certainly not in the Bloom filter bits."""
+    h = hash(id)
+    size = len(bits) * 8
+    for probe in (h, h >> 21, h >> 42):
+        i = probe % size
+        if not bits[i >> 3] & (1 << (i & 7)):
+            return False
+    return True
+
+
+class SpilledPostings(object):
+    """A set-like collection of data entry ids backed by a PostingStore
+    run. Supports the set operations TypeAheadRadixTrie uses.
+    """
+
+    __slots__ = ('store', 'run', 'filter', 'added', 'removed')
+
+    def __init__(self, store, run, filter, added=None, removed=None):
+        self.store = store
+        self.run = run
+        store.acquire(run)
+
+        # A Bloom filter of the run, so that most ids that aren't in it
+        # can be turned away without reading it.
+        self.filter = filter
+
+        # Ids added since the run was written, none of which are in it,
+        # and ids removed since, all of which are.
+        self.added = added or set()
+        self.removed = removed or set()
+
+    def __del__(self):
+        self.store.release(self.run)
+
+    def _base(self):
+        return self.store.read(self.run)
+
+    def _in_base(self, id):
+        return bloom_contains(self.filter, id) and id in self._base()
+
+    def __len__(self):
+        return self.run[2] + len(self.added) - len(self.removed)
+
+    def __nonzero__(self):
+        return len(self) > 0
+
+    def __contains__(self, id):
+        if id in self.added:
+            return True
+        if id in self.removed:
+            return False
+        return self._in_base(id)
+
+    def _set(self):
+        """Return the ids as a new frozenset."""
+        ids = self._base() - self.removed
+        ids |= self.added
+        return ids
+
+    def __iter__(self):
+        return iter(self._set())
+
+    def __eq__(self, other):
+        return len(self) == len(other) and self._set() == set(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __and__(self, other):
+        """Return the set of ids in both."""
+        if not isinstance(other, (set, frozenset)):
+            other = set(other)
+        ids = set(other & self._base())
+        ids -= self.removed
+        ids |= other & self.added
+        return ids
+
+    __rand__ = __and__
+
+    def add(self, id):
+        if id in self.removed:
+            self.removed.remove(id)
+        elif id not in self.added and not self._in_base(id):
+            self.added.add(id)
+            self._compact()
+
+    def discard(self, id):
+        if id in self.added:
+            self.added.remove(id)
+        elif id not in self.removed and self._in_base(id):
+            self.removed.add(id)
+            self._compact()
+
+    def copy(self):
+        return SpilledPostings(
+            self.store, self.run, self.filter,
+            set(self.added), set(self.removed)
+        )
+
+    def _compact(self):
+        """Write a new run once the in-memory changes grow past an eighth
+        of the run, which keeps rewrites to a constant amortized cost.
+        """
+        if len(self.added) + len(self.removed) > self.run[2] // 8:
+            ids = self._set()
+            run = self.store.write(ids)
+            self.store.acquire(run)
+            # Copies may still hold the old run.
+            self.store.release(self.run)
+            self.run = run
+            self.filter = bloom_filter(ids)
+            self.added = set()
+            self.removed = set()
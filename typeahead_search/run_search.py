@@ -0,0 +1,10 @@
+"""Run the search loop from search.py's compiled module.
+
+Python compiles the script it runs from source every time, but caches
+imported modules, so `python -S run_search.py [snapshot] < commands`
+starts faster than running search.py itself.
+"""
+import sys
+from search import main
+
+main(*sys.argv[1:2])
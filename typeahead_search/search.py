@@ -1,16 +1,55 @@
 import sys
-import string
+import heapq
+from bisect import insort
 from operator import itemgetter
-from os.path import commonprefix
+
+# string.punctuation, without the cost of importing string (and re).
+PUNCTUATION = '!"#$%&\'()*+,-./:;<=>?@[\\]^_`{|}~'
+
+# An upper bound on the stack frames cPickle uses for each level of a Trie
+# (the node, its __dict__, its children dict and the (path, child) tuple,
+# with some to spare).
+PICKLE_FRAMES_PER_NODE = 8
+
+# The classes of this module that snapshots name.
+SNAPSHOT_CLASSES = frozenset([
+    'TypeAheadRadixTrie', 'TypePartitionedTrie', 'TypeAheadSearchSession'
+])
+
+
+def _common_prefix(word, path):
+    """Return the longest common prefix of two strings.
+    Replaces os.path.commonprefix, which imports os and much else.
+    """
+    if word.startswith(path):
+        return path
+    i = 0
+    end = min(len(word), len(path))
+    while i < end and word[i] == path[i]:
+        i += 1
+    return word[:i]
 
 
 class TypeAheadRadixTrie(object):
     """A Radix Trie class for use in typeahead search."""
 
-    def __init__(self, entries=None, root=True):
+    # An ascending list of the best (score, added, id) tuples among this
+    # node's entries, or None if this node doesn't keep one. The best best_k
+    # are served; up to as many again are kept as slack, so that deleting
+    # the best entries doesn't force a rebuild each time. These are class
+    # attributes so that the many nodes without a list don't pay for them.
+    best = None
+    best_k = 0
+
+    # A store to spill large sets of entries to, or None to keep them all
+    # in memory. See postings.PostingStore.
+    store = None
+
+    def __init__(self, entries=None, root=True, store=None):
         """Create a new TypeAheadRadixTrie.
         If entries is a set, copy it to self.entries.
         If root is True, we are the root node.
+        If store is given, spill large sets of entries to it.
         """
 
         # The children of this node. Because ordered traversals are not
@@ -29,6 +68,9 @@ class TypeAheadRadixTrie(object):
         else:
             self.entries = set()
 
+        if store is not None:
+            self.store = store
+
     def __contains__(self, word):
         """Determines whether words (not entries) are stored in the Radix Trie.
         For use in testing.
@@ -48,41 +90,76 @@ class TypeAheadRadixTrie(object):
         """
         return self.root or bool(self.entries)
 
-    def add(self, word, id):
+    def depth(self):
+        """Return the number of nodes on the longest path below this one.
+        Walks the Trie iteratively, so it works however deep the Trie is.
+        """
+        depth = 0
+        level = [self]
+        while level:
+            level = [
+                child for node in level
+                for path, child in node.children.itervalues()
+            ]
+            depth += bool(level)
+        return depth
+
+    def add(self, word, id, rank=None):
         """Adds the given data entry id to the given Radix Trie word.
         The word is created in the Radix Trie if it doesn't already exist.
+        rank is the (score, added) of the entry, used to maintain best
+        lists; without it, best lists along the word are dropped.
         """
         # Don't store entries if we are the root.
         if not self.root:
+            # Keep our best list up to date, if we have one.
+            if self.best is not None and id not in self.entries:
+                if rank is None:
+                    self.best = None
+                else:
+                    insort(self.best, rank + (id,))
+                    if len(self.best) > 2 * self.best_k:
+                        del self.best[0]
+
             self.entries.add(id)
 
+            # Spill our entries once they grow large.
+            if (self.store is not None and type(self.entries) is set
+                    and len(self.entries) > self.store.spill_size):
+                self.entries = self.store.spill(self.entries)
+
         if word:
             # Retrieve the candidate path, or create a path for this
             # word if a candidate path doesn't exist.
             path, child = self.children.setdefault(
                 word[0],
-                (word, TypeAheadRadixTrie(root=False))
+                (word, TypeAheadRadixTrie(root=False, store=self.store))
             )
 
             # Get the longest prefix the path and the word share.
-            common = commonprefix((word, path))
+            common = _common_prefix(word, path)
 
             # If the path prefixes the word, pass on the postfix to the child.
             if common == path:
-                child.add(word[len(path):], id)
+                child.add(word[len(path):], id, rank)
 
             # If the word and the path share a prefix, split the path in
             # two and insert a new node, then add the remainder of this
             # word from that node.
             else:
-                new_child = TypeAheadRadixTrie(child.entries, root=False)
+                new_child = TypeAheadRadixTrie(
+                    child.entries, root=False, store=self.store
+                )
+                if child.best is not None:
+                    new_child.best = list(child.best)
+                    new_child.best_k = child.best_k
                 new_child_path = path[len(common):]
                 self.children[word[0]] = (common, new_child)
                 new_child.children[new_child_path[0]] = (
                     new_child_path,
                     child
                 )
-                new_child.add(word[len(common):], id)
+                new_child.add(word[len(common):], id, rank)
 
     def delete(self, word, id):
         """Deletes the given data entry id from the given Radix Trie word.
@@ -92,6 +169,24 @@ class TypeAheadRadixTrie(object):
         # Discard the entry, if it hasn't already been discarded.
         self.entries.discard(id)
 
+        # Bring spilled entries back into memory once they grow small.
+        if (self.store is not None and type(self.entries) is not set
+                and len(self.entries) <= self.store.spill_size // 2):
+            self.entries = set(self.entries)
+
+        # Drop the entry from our best list, if it's there. Once the slack
+        # runs out and fewer than best_k are left while other entries
+        # aren't accounted for, we no longer know the best best_k, so drop
+        # the whole list; it will be rebuilt on demand.
+        if self.best is not None:
+            for i, ranked in enumerate(self.best):
+                if ranked[2] == id:
+                    del self.best[i]
+                    if (len(self.best) < self.best_k
+                            and len(self.best) < len(self.entries)):
+                        self.best = None
+                    break
+
         # If we have no entries left, and we are not the root, short-circuit.
         # Our parent will delete us.
         if not self.root and not self.entries:
@@ -129,6 +224,7 @@ class TypeAheadRadixTrie(object):
     def search(self, word):
         """Return a set of all data entry ids represented by prefix `word`.
         Returns an empty set if this prefix is not in the Trie.
+        The set may be a postings.SpilledPostings if entries are spilled.
         """
         if word:
             # Get the candidate path to the remaining postfix of the
@@ -147,14 +243,282 @@ class TypeAheadRadixTrie(object):
         else:
             return self.entries
 
+    def search_all(self, words):
+        """Return a set of the data entry ids represented by every prefix
+        in `words`. The set must not be modified.
+        """
+        # Get the set for each word, smallest first. Each node knows the
+        # size of its set, so this is cheap.
+        postings = sorted((self.search(word) for word in words), key=len)
+
+        # A single set needs no intersecting, and so no copy.
+        if len(postings) == 1:
+            return postings[0]
+
+        # Intersect the larger sets into a copy of the smallest, stopping
+        # as soon as nothing is left. Each intersection probes the larger
+        # set once per id remaining in the smaller one.
+        results = set(postings[0])
+        for other in postings[1:]:
+            if not results:
+                break
+            results &= other
+
+        return results
+
+    def top(self, word, top_k, rank):
+        """Return a list of the best top_k (score, added, id) tuples among
+        the data entry ids represented by prefix `word`, best first.
+        rank is a function mapping an id to its (score, added).
+        The list is kept on the node and maintained by add and delete, so
+        later calls are answered without touching the node's entries.
+        """
+        if word:
+            path, child = self.children.get(word[0], ('', None))
+            if (path and word.startswith(path)) or path.startswith(word):
+                return child.top(word[len(path):], top_k, rank)
+            return []
+
+        # The root stores no entries.
+        if self.root:
+            return []
+
+        if self.best is None or self.best_k != top_k:
+            self.best = heapq.nlargest(
+                2 * top_k, (rank(id) + (id,) for id in self.entries)
+            )
+            self.best.reverse()
+            self.best_k = top_k
+
+        return self.best[:-top_k - 1:-1]
+
+    def fuzzy_search(self, word, max_distance, max_visits=None):
+        """Return a set of all data entry ids represented by a prefix within
+        `max_distance` edits (Levenshtein distance) of `word`.
+        If max_visits is given, stop after visiting that many nodes; the
+        result may then be incomplete.
+        """
+        results = set()
+
+        # The remaining node visit budget. Stored in a list so that it can
+        # be shared by the whole recursive walk.
+        budget = [max_visits]
+
+        # The first row of the Levenshtein table: the distance from each
+        # prefix of the word to the empty string.
+        self._fuzzy_search(
+            word, range(len(word) + 1), max_distance, results, budget
+        )
+        return results
+
+    def _fuzzy_search(self, word, row, max_distance, results, budget):
+        """Walk the paths out of this node, extending the Levenshtein table
+        row by row, and collect the entries of every child reached by a
+        prefix within max_distance of the word.
+        """
+        for path, child in self.children.itervalues():
+            if budget[0] is not None:
+                if budget[0] <= 0:
+                    return
+                budget[0] -= 1
+
+            # Extend the table one row for each letter of the path.
+            child_row = row
+            for letter in path:
+                previous_row, child_row = child_row, [child_row[0] + 1]
+                for i in range(1, len(word) + 1):
+                    child_row.append(min(
+                        child_row[i - 1] + 1,
+                        previous_row[i] + 1,
+                        previous_row[i - 1] + (word[i - 1] != letter)
+                    ))
+
+                # If the whole word is within max_distance of the prefix
+                # so far, every entry beneath this path is a match.
+                if child_row[-1] <= max_distance:
+                    results.update(child.entries)
+                    break
+
+                # If no prefix of the word is within max_distance, no
+                # extension of this path can bring the word back in range.
+                if min(child_row) > max_distance:
+                    break
+
+            # Only descend if we consumed the whole path without matching
+            # or pruning.
+            else:
+                child._fuzzy_search(
+                    word, child_row, max_distance, results, budget
+                )
+
+
+class TypePartitionedTrie(object):
+    """A set of TypeAheadRadixTries, one per data entry type, so that
+    searches can be limited to some types without touching the others.
+    """
+
+    def __init__(self, store=None, partitioned=True):
+        """Create a new TypePartitionedTrie.
+        If store is given, the Tries spill large sets of entries to it.
+        If partitioned is False, keep every type in a single Trie instead.
+        That saves the nodes each type's Trie would repeat for words shared
+        with other types, but searches can then only cover all types.
+        """
+        # The Trie for each type, keyed by type, or under None if we're
+        # not partitioned.
+        self.tries = {}
+        self.store = store
+        self.partitioned = partitioned
+
+    def __contains__(self, word):
+        """Determines whether words are stored in any of the Tries.
+        For use in testing.
+        """
+        return any(word in trie for trie in self.tries.itervalues())
+
+    def partitions(self, types=None):
+        """Return a list of the Tries for the given types, or for all types
+        if types is None.
+        Raises ValueError if types are given but we're not partitioned.
+        """
+        if types is None:
+            return self.tries.values()
+        if not self.partitioned:
+            raise ValueError("Tries are not partitioned by type.")
+        return [self.tries[type] for type in set(types) if type in self.tries]
+
+    def add(self, type, word, id, rank=None):
+        """Adds the given data entry id to the given word in the Trie for
+        its type. See TypeAheadRadixTrie.add.
+        """
+        if not self.partitioned:
+            type = None
+        trie = self.tries.get(type)
+        if trie is None:
+            trie = self.tries[type] = TypeAheadRadixTrie(store=self.store)
+        trie.add(word, id, rank)
+
+    def delete(self, type, word, id):
+        """Deletes the given data entry id from the given word in the Trie
+        for its type. See TypeAheadRadixTrie.delete.
+        """
+        self.tries[type if self.partitioned else None].delete(word, id)
+
+    def search(self, word, types=None):
+        """Return a new set of all data entry ids of the given types
+        represented by prefix `word`.
+        """
+        results = set()
+        for trie in self.partitions(types):
+            results.update(trie.search(word))
+        return results
+
+    def search_all(self, words, types=None):
+        """Return a list of the nonempty sets of data entry ids represented
+        by every prefix in `words`, one per type searched. The sets must
+        not be modified.
+        """
+        results = []
+        for trie in self.partitions(types):
+            ids = trie.search_all(words)
+            if ids:
+                results.append(ids)
+        return results
+
+    def top(self, word, top_k, rank, types=None):
+        """Return a list of the best top_k (score, added, id) tuples among
+        the data entry ids of the given types represented by prefix `word`,
+        best first. See TypeAheadRadixTrie.top.
+        """
+        best = []
+        for trie in self.partitions(types):
+            best.extend(trie.top(word, top_k, rank))
+        best.sort(reverse=True)
+        return best[:top_k]
+
+    def fuzzy_search(self, word, max_distance, max_visits=None, types=None):
+        """Return a set of all data entry ids of the given types represented
+        by a prefix within `max_distance` edits of `word`.
+        See TypeAheadRadixTrie.fuzzy_search; max_visits is shared by all
+        the Tries searched.
+        """
+        results = set()
+        budget = [max_visits]
+        for trie in self.partitions(types):
+            trie._fuzzy_search(
+                word, range(len(word) + 1), max_distance, results, budget
+            )
+        return results
+
 
 class TypeAheadSearchSession(object):
     """Class encapsulating a typeahead search session."""
 
-    def __init__(self):
-        self.trie = TypeAheadRadixTrie()
+    def __init__(self, top_k=0, top_k_depth=3, store=None,
+                 partition_types=False):
+        """Create a new TypeAheadSearchSession.
+        If top_k is nonzero, single word QUERYs for prefixes of at most
+        top_k_depth letters asking for at most top_k results are answered
+        from best lists kept on the Trie nodes.
+        If store is given, the Trie spills large sets of entries to it.
+        If partition_types is True, keep a Trie per type, so that TQUERY
+        touches only the types asked for, at the cost of more memory;
+        otherwise TQUERY filters the results of all types.
+        """
+        self.trie = TypePartitionedTrie(
+            store=store, partitioned=partition_types
+        )
         self.entries = {}
         self.added = 0
+        self.top_k = top_k
+        self.top_k_depth = top_k_depth
+
+    def dump(self, file):
+        """Write a snapshot of this session to an open binary file.
+        The snapshot can seed a later session through load or main.
+        Raises TypeError if the session spills to a PostingStore, which
+        can't be snapshotted.
+        """
+        # Imported here; most runs never touch snapshots.
+        import cPickle
+
+        # cPickle recurses through the Trie, several frames per node, so
+        # deep Tries (long words) need more than the default limit.
+        # Loading doesn't recurse.
+        depth = max([trie.depth() for trie in self.trie.partitions()] or [0])
+        limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(limit + PICKLE_FRAMES_PER_NODE * depth)
+        try:
+            cPickle.dump(self, file, cPickle.HIGHEST_PROTOCOL)
+        finally:
+            sys.setrecursionlimit(limit)
+
+    @staticmethod
+    def _find_class(module, name):
+        """Resolve a class named in a snapshot.
+        This module's classes resolve here, whichever path it was imported
+        under when the snapshot was dumped (search, a package's search, or
+        __main__), so that snapshots load however this module is run.
+        """
+        if name in SNAPSHOT_CLASSES and (
+            module == '__main__' or module.rsplit('.', 1)[-1] == 'search'
+        ):
+            return globals()[name]
+        __import__(module)
+        return getattr(sys.modules[module], name)
+
+    @classmethod
+    def load(cls, file):
+        """Return the session snapshotted to an open binary file by dump."""
+        import cPickle
+        unpickler = cPickle.Unpickler(file)
+        unpickler.find_global = cls._find_class
+        session = unpickler.load()
+        if not isinstance(session, cls):
+            raise ValueError(
+                "Snapshot does not contain a {}.".format(cls.__name__)
+            )
+        return session
 
     def run_command(self, command):
         """Validate and execute a search command."""
@@ -167,67 +531,137 @@ class TypeAheadSearchSession(object):
             return self.query(command)
         elif command_type == 'WQUERY':
             return self.wquery(command)
+        elif command_type == 'TQUERY':
+            return self.tquery(command)
         else:
             raise ValueError(
                 "Command \"{}\" is not of type ADD, DEL, QUERY,"
-                " or WQUERY.".format(command)
+                " WQUERY, or TQUERY.".format(command)
             )
 
-    def add(self, command):
-        """Add a new item."""
+    @staticmethod
+    def parse_add(command):
+        """Parse the arguments of an ADD command.
+        Returns (type, id, score, data, words), where words are the search
+        tokens to store the item under. Touches no session state, so it
+        can be run ahead of time, or elsewhere; see ingest.
+        """
         type, id, score, data = command.split(None, 3)
-        self.added += 1
-        new_entry = (type, id, float(score), data, self.added)
-        self.entries[id] = new_entry
 
+        words = []
         for word in data.lower().split():
             # Attempt to strip punctuation off of each word before storing
             # it as a search token.
-            word = word.strip(string.punctuation)
+            word = word.strip(PUNCTUATION)
 
             # If the word was just a blob of punctuation, don't store it.
             if not word:
                 continue
 
-            self.trie.add(word, id)
+            words.append(word)
+
+        return type, id, float(score), data, words
+
+    def add(self, command):
+        """Add a new item."""
+        self.add_parsed(self.parse_add(command))
+
+    def add_parsed(self, parsed):
+        """Add a new item from the result of parse_add."""
+        type, id, score, data, words = parsed
+
+        # Intern the id; it is shared by every Trie node the entry is
+        # stored at, and by spilled postings read back from disk.
+        id = intern(id)
+        self.added += 1
+        self.entries[id] = (type, id, score, data, self.added)
+
+        for word in words:
+            self.trie.add(type, word, id, (score, self.added))
 
     def delete(self, id):
         """Delete an item."""
+        type = self.entries[id][0]
         for word in self.entries[id][3].lower().split():
-            word = word.strip(string.punctuation)
+            word = word.strip(PUNCTUATION)
             if not word:
                 continue
 
-            self.trie.delete(word, id)
+            self.trie.delete(type, word, id)
 
         del self.entries[id]
 
-    def _query_base(self, *search_words):
-        """The portion of prefix search common to both query and wquery."""
-        # Get the results set for one of the search words.
-        results = self.trie.search(
-            search_words[0].strip(string.punctuation).lower()
-        ).copy()
-
-        # Intersect the results sets for the remaining search words into
-        # the first results set.
-        for word in search_words[1:]:
-            results &= self.trie.search(
-                word.strip(string.punctuation).lower()
+    def _query_base(self, search_words, types=None):
+        """The portion of prefix search common to all queries.
+        Returns a list of the nonempty sets of matching ids, one per type
+        searched, which must not be modified.
+        """
+        return self.trie.search_all(
+            [word.strip(PUNCTUATION).lower() for word in search_words],
+            types
+        )
+
+    def _best(self, results, num_results, key):
+        """Return the best num_results entries, by key, among the sets of
+        ids returned by _query_base. Each set is ranked separately and the
+        results merged.
+        """
+        best = []
+        for ids in results:
+            best.extend(heapq.nlargest(
+                num_results, (self.entries[id] for id in ids), key=key
+            ))
+        best.sort(key=key, reverse=True)
+        return best[:num_results]
+
+    def _rank(self, id):
+        """Return the (score, added) ranking key of an entry."""
+        entry = self.entries[id]
+        return entry[2], entry[4]
+
+    def _query(self, num_results, search_words, types=None):
+        """Return the best num_results entries of the given types matching
+        all of search_words.
+        """
+        # Without a Trie per type, search every type and filter after.
+        if types is not None and not self.trie.partitioned:
+            types = set(types)
+            return self._best(
+                (
+                    [id for id in ids if self.entries[id][0] in types]
+                    for ids in self._query_base(search_words)
+                ),
+                num_results,
+                itemgetter(2, 4)
             )
 
-        return results
+        # Answer short single word queries from the best lists.
+        if len(search_words) == 1 and num_results <= self.top_k:
+            word = search_words[0].strip(PUNCTUATION).lower()
+            if len(word) <= self.top_k_depth:
+                best = self.trie.top(word, self.top_k, self._rank, types)
+                return [
+                    self.entries[id] for score, added, id
+                    in best[:num_results]
+                ]
+
+        return self._best(
+            self._query_base(search_words, types),
+            num_results,
+            itemgetter(2, 4)
+        )
 
     def query(self, command):
         """Perform a search."""
         num_results, search_words = command.split(None, 1)
-        num_results = int(num_results)
+        return self._query(int(num_results), search_words.split())
 
-        return sorted(
-            (self.entries[id] for id in self._query_base(*search_words.split())),
-            key=itemgetter(2, 4),
-            reverse=True
-        )[:num_results]
+    def tquery(self, command):
+        """Perform a search limited to a comma separated list of types."""
+        num_results, types, search_words = command.split(None, 2)
+        return self._query(
+            int(num_results), search_words.split(), types.split(',')
+        )
 
     def wquery(self, command):
         """Perform a weighted search."""
@@ -243,31 +677,42 @@ class TypeAheadSearchSession(object):
             else:
                 boosts[key] = float(value)
 
-        return sorted(
-            (self.entries[id] for id in self._query_base(*search_words.split())),
-            key=lambda e: (
+        return self._best(
+            self._query_base(search_words.split()),
+            num_results,
+            lambda e: (
                 e[2] * boosts.get(e[0], 1) * boosts.get(e[1], 1),
                 e[4]
-            ),
-            reverse=True
-        )[:num_results]
+            )
+        )
 
 
 def main(session=None):
-    """Main search loop."""
+    """Main search loop.
+    session may be a TypeAheadSearchSession, or the path to a snapshot
+    written by TypeAheadSearchSession.dump to seed a warm session from.
+    """
     if not session:
         session = TypeAheadSearchSession()
+    elif isinstance(session, basestring):
+        with open(session, 'rb') as snapshot:
+            session = TypeAheadSearchSession.load(snapshot)
+
+    # Bind what the loop uses to locals, sparing a lookup per command.
+    readline = sys.stdin.readline
+    write = sys.stdout.write
+    run_command = session.run_command
 
     # Get the number of expected commands.
-    num_commands = int(sys.stdin.readline().strip())
+    num_commands = int(readline().strip())
 
     # Fetch each command from the input.
-    for i in range(num_commands):
-        command = sys.stdin.readline().strip()
-        results = session.run_command(command)
+    for i in xrange(num_commands):
+        results = run_command(readline().strip())
         if results is not None:
-            print ' '.join(result[1] for result in results)
+            write(' '.join(result[1] for result in results) + '\n')
 
 
 if __name__ == '__main__':
-    main()
+    # An optional argument names a snapshot to seed the session from.
+    main(*sys.argv[1:2])
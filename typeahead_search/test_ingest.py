@@ -0,0 +1,62 @@
+import unittest
+from ingest import ingest, chunks
+from search import TypeAheadSearchSession
+
+
+class TestIngest(unittest.TestCase):
+    def setUp(self):
+        self.commands = [
+            "ADD question q{} 0.{} Question number {}, sort of.".format(
+                i, i % 10, i
+            )
+            for i in range(50)
+        ]
+        self.commands[10:10] = ["QUERY 3 quest", "DEL q3"]
+        self.commands.append("WQUERY 5 1 q7:10 number")
+
+        self.expected = TypeAheadSearchSession()
+        self.expected_results = [
+            result for result in map(self.expected.run_command, self.commands)
+            if result is not None
+        ]
+
+    def check(self, **kwargs):
+        session = TypeAheadSearchSession()
+        results = ingest(session, iter(self.commands), chunk_size=7, **kwargs)
+        self.assertEqual(results, self.expected_results)
+        self.assertEqual(session.entries, self.expected.entries)
+        self.assertEqual(session.added, self.expected.added)
+        self.assertEqual(
+            session.query("100 sort"), self.expected.query("100 sort")
+        )
+
+    def test_serial(self):
+        """Ingesting without workers matches running each command."""
+        self.check()
+
+    def test_threads(self):
+        """Ingesting with worker threads matches running each command."""
+        self.check(workers=3, max_pending=2)
+
+    def test_processes(self):
+        """Ingesting with worker processes matches running each command."""
+        self.check(workers=2, processes=True)
+
+    def test_file_lines(self):
+        """Lines read from a file are stripped, and blank ones skipped."""
+        self.commands = [command + '\n' for command in self.commands]
+        self.commands.insert(20, '\n')
+        self.check()
+        session = TypeAheadSearchSession()
+        ingest(session, ["ADD user u1 0.5 Some User\n"])
+        self.assertEqual(session.entries['u1'][3], "Some User")
+
+    def test_chunks(self):
+        """Commands are split into chunks of at most chunk_size."""
+        self.assertEqual(
+            list(chunks(range(5), 2)), [[0, 1], [2, 3], [4]]
+        )
+        self.assertEqual(list(chunks([], 2)), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+import cPickle
+import unittest
+from postings import (
+    PostingStore, SpilledPostings, bloom_filter, bloom_contains
+)
+
+
+class TestBloomFilter(unittest.TestCase):
+    def test_contains(self):
+        """Bloom filters contain every id they were built from, and turn
+        away most others.
+        """
+        ids = set('u{}'.format(i) for i in range(1000))
+        bits = bloom_filter(ids)
+        self.assertTrue(all(bloom_contains(bits, id) for id in ids))
+        false_positives = sum(
+            bloom_contains(bits, 't{}'.format(i)) for i in range(1000)
+        )
+        self.assertLess(false_positives, 100)
+
+    def test_empty(self):
+        """An empty Bloom filter contains nothing."""
+        self.assertFalse(bloom_contains(bloom_filter(set()), 'u1'))
+
+
+class TestPostingStore(unittest.TestCase):
+    def setUp(self):
+        self.store = PostingStore(spill_size=4)
+        self.addCleanup(self.store.close)
+
+    def test_write_read(self):
+        """Runs read back hold the ids written."""
+        run = self.store.write(set(['u1', 't1', 'q1']))
+        self.assertEqual(run[2], 3)
+        self.assertEqual(self.store.read(run), frozenset(['u1', 't1', 'q1']))
+
+    def test_read_from_file(self):
+        """Runs evicted from the cache are read back from the file."""
+        runs = [self.store.write(set(['u1', 't1'])), self.store.write(set())]
+        self.store.cache.clear()
+        self.assertEqual(self.store.read(runs[0]), frozenset(['u1', 't1']))
+        self.assertEqual(self.store.read(runs[1]), frozenset())
+
+    def test_cache_budget(self):
+        """The cache evicts least recently used runs to fit its budget."""
+        run_bytes = PostingStore._size(frozenset(['u1', 't1']))
+        self.store.cache_bytes = 2 * run_bytes
+        runs = [self.store.write(set(['u1', 't1'])) for i in range(3)]
+        self.assertEqual(list(self.store.cache), [runs[1][0], runs[2][0]])
+        self.store.read(runs[0])
+        self.assertEqual(list(self.store.cache), [runs[2][0], runs[0][0]])
+        self.assertLessEqual(self.store.cached_bytes, self.store.cache_bytes)
+
+    def test_forget(self):
+        """Forgotten runs leave the cache but can still be read."""
+        run = self.store.write(set(['u1', 't1']))
+        self.store.forget(run)
+        self.assertEqual(len(self.store.cache), 0)
+        self.assertEqual(self.store.cached_bytes, 0)
+        self.assertEqual(self.store.read(run), frozenset(['u1', 't1']))
+
+    def test_reclaim(self):
+        """Once dead runs outgrow live ones, the file is compacted and the
+        live runs can still be read.
+        """
+        dead = [self.store.spill(set(['q1', 'q2']))]
+        live = self.store.spill(set(['u1', 't1']))
+        dead.append(self.store.spill(set(['q3', 'q4'])))
+        dead.pop()
+        self.assertEqual(self.store.dead_bytes, 5)
+        self.store.file.seek(0, 2)
+        self.assertEqual(self.store.file.tell(), 15)
+
+        dead.pop()
+        self.assertEqual(self.store.dead_bytes, 0)
+        self.store.file.seek(0, 2)
+        self.assertEqual(self.store.file.tell(), 5)
+        self.store.cache.clear()
+        self.assertEqual(set(live), set(['u1', 't1']))
+
+    def test_shared_run(self):
+        """A run stays live while any copy holds it."""
+        postings = self.store.spill(set(['u1', 't1']))
+        copy = postings.copy()
+        del postings
+        self.assertEqual(self.store.dead_bytes, 0)
+        self.store.cache.clear()
+        self.assertEqual(set(copy), set(['u1', 't1']))
+        del copy
+        self.assertEqual(self.store.live_bytes, 0)
+
+    def test_pickle(self):
+        """Stores, and postings spilled to them, refuse to be pickled."""
+        self.assertRaises(TypeError, cPickle.dumps, self.store, 2)
+        postings = self.store.spill(set(['u1', 't1']))
+        self.assertRaises(TypeError, cPickle.dumps, postings, 2)
+
+    def test_cache_keeps_newest(self):
+        """A run larger than the whole budget is still cached."""
+        self.store.cache_bytes = 0
+        run = self.store.write(set(['u1']))
+        self.assertEqual(list(self.store.cache), [run[0]])
+
+
+class TestSpilledPostings(unittest.TestCase):
+    def setUp(self):
+        self.store = PostingStore(spill_size=4)
+        self.addCleanup(self.store.close)
+        self.postings = self.store.spill(set(['u1', 't1', 'q1']))
+
+    def test_set_operations(self):
+        """Spilled postings behave like the set they were spilled from."""
+        self.postings.add('b1')
+        self.postings.add('u1')
+        self.postings.discard('t1')
+        self.postings.discard('x1')
+        expected = set(['u1', 'q1', 'b1'])
+
+        self.assertEqual(len(self.postings), 3)
+        self.assertEqual(set(self.postings), expected)
+        self.assertIn('b1', self.postings)
+        self.assertNotIn('t1', self.postings)
+        self.assertTrue(self.postings == expected)
+        self.assertTrue(expected == self.postings)
+        self.assertFalse(self.postings != expected)
+        self.assertEqual(self.postings & set(['b1', 'x1']), set(['b1']))
+        self.assertEqual(set(['q1', 'x1']) & self.postings, set(['q1']))
+
+    def test_empty(self):
+        """Spilled postings are false once emptied."""
+        for id in ('u1', 't1', 'q1'):
+            self.postings.discard(id)
+        self.assertFalse(self.postings)
+
+    def test_copy(self):
+        """Copies are independent of the original."""
+        copy = self.postings.copy()
+        copy.add('b1')
+        copy.discard('u1')
+        self.assertEqual(set(self.postings), set(['u1', 't1', 'q1']))
+        self.assertEqual(set(copy), set(['t1', 'q1', 'b1']))
+
+    def test_compact(self):
+        """Changes are written to a new run once they grow too large."""
+        run = self.postings.run
+        for i in range(5):
+            self.postings.add('b{}'.format(i))
+        self.assertNotEqual(self.postings.run, run)
+        self.assertEqual(self.postings.run[2], 8)
+        self.assertEqual(len(self.postings.added), 0)
+        self.assertEqual(len(self.postings), 8)
+
+if __name__ == '__main__':
+    unittest.main()
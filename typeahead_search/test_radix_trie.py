@@ -1,5 +1,6 @@
 import unittest
-from search import TypeAheadRadixTrie
+from search import TypeAheadRadixTrie, TypePartitionedTrie
+from postings import PostingStore, SpilledPostings
 
 
 class TestRadixTrie(unittest.TestCase):
@@ -25,6 +26,14 @@ class TestRadixTrie(unittest.TestCase):
         self.assertIn('car', self.trie)
         self.assertIn('cartel', self.trie)
 
+    def test_depth(self):
+        """Depth counts the nodes on the longest path below the root."""
+        self.assertEqual(self.trie.depth(), 0)
+        self.trie.add('car', self.ids[0])
+        self.trie.add('cartel', self.ids[1])
+        self.trie.add('dog', self.ids[1])
+        self.assertEqual(self.trie.depth(), 2)
+
     def test_add_word(self):
         """The Trie takes on the expected form when a word is added."""
         self.trie.add('some', self.ids[0])
@@ -299,5 +308,256 @@ class TestRadixTrie(unittest.TestCase):
         self.assertIn(self.ids[0], result)
         self.assertIn(self.ids[1], result)
 
+    def test_fuzzy_search_exact(self):
+        """Fuzzy search with no edits allowed behaves like search."""
+        self.trie.add('some', self.ids[0])
+        self.trie.add('day', self.ids[1])
+        self.assertEqual(self.trie.fuzzy_search('som', 0), set([self.ids[0]]))
+        self.assertEqual(self.trie.fuzzy_search('ome', 0), set())
+
+    def test_fuzzy_search_substitution(self):
+        """Fuzzy search tolerates a mistyped letter."""
+        self.trie.add('some', self.ids[0])
+        self.trie.add('somebody', self.ids[1])
+        result = self.trie.fuzzy_search('sime', 1)
+        self.assertEqual(result, set(self.ids))
+
+    def test_fuzzy_search_insertion_and_deletion(self):
+        """Fuzzy search tolerates missing and extra letters."""
+        self.trie.add('somebody', self.ids[0])
+        self.assertIn(self.ids[0], self.trie.fuzzy_search('smeb', 1))
+        self.assertIn(self.ids[0], self.trie.fuzzy_search('soomeb', 1))
+
+    def test_fuzzy_search_out_of_range(self):
+        """Prefixes too many edits away are not matched."""
+        self.trie.add('some', self.ids[0])
+        self.assertEqual(self.trie.fuzzy_search('sxxe', 1), set())
+        self.assertIn(self.ids[0], self.trie.fuzzy_search('sxxe', 2))
+
+    def test_fuzzy_search_split_path(self):
+        """Fuzzy search matches across nodes split from a single path."""
+        self.trie.add('somebody', self.ids[0])
+        self.trie.add('someday', self.ids[1])
+        result = self.trie.fuzzy_search('somebidy', 1)
+        self.assertEqual(result, set([self.ids[0]]))
+
+    def test_fuzzy_search_max_visits(self):
+        """Fuzzy search stops once it has visited max_visits nodes."""
+        self.trie.add('some', self.ids[0])
+        self.trie.add('day', self.ids[1])
+        self.assertEqual(len(self.trie.fuzzy_search('xay', 1, 0)), 0)
+        self.assertLessEqual(len(self.trie.fuzzy_search('xay', 1, 1)), 1)
+        self.assertEqual(
+            self.trie.fuzzy_search('xay', 1, 2), set([self.ids[1]])
+        )
+
+    def test_top(self):
+        """Top returns the best entries of a prefix, best first."""
+        ranks = {'u1': (0.5, 1), 't1': (0.7, 2), 'q1': (0.6, 3)}
+        for id in ranks:
+            self.trie.add('some', id, ranks[id])
+        result = self.trie.top('so', 2, ranks.get)
+        self.assertEqual(result, [(0.7, 2, 't1'), (0.6, 3, 'q1')])
+        self.assertEqual(self.trie.children['s'][1].best_k, 2)
+
+    def test_top_add(self):
+        """Adding an entry updates the best-top_k lists along its word."""
+        ranks = {'u1': (0.5, 1), 't1': (0.7, 2), 'q1': (0.6, 3)}
+        self.trie.add('some', 'u1', ranks['u1'])
+        self.trie.add('some', 't1', ranks['t1'])
+        self.trie.top('some', 2, ranks.get)
+        self.trie.add('someday', 'q1', ranks['q1'])
+        self.assertEqual(
+            self.trie.children['s'][1].best,
+            [(0.5, 1, 'u1'), (0.6, 3, 'q1'), (0.7, 2, 't1')]
+        )
+        self.assertEqual(
+            self.trie.top('some', 2, ranks.get),
+            [(0.7, 2, 't1'), (0.6, 3, 'q1')]
+        )
+
+    def test_top_split(self):
+        """Nodes split from a node with a best-top_k list inherit it."""
+        ranks = {'u1': (0.5, 1), 't1': (0.7, 2)}
+        self.trie.add('somebody', 'u1', ranks['u1'])
+        self.trie.top('some', 2, ranks.get)
+        self.trie.add('someday', 't1', ranks['t1'])
+        node = self.trie.children['s'][1]
+        self.assertEqual(node.best, [(0.5, 1, 'u1'), (0.7, 2, 't1')])
+        self.assertEqual(node.children['b'][1].best, [(0.5, 1, 'u1')])
+
+    def test_top_delete(self):
+        """Deleting an entry updates or drops the best-top_k lists."""
+        ranks = {'u1': (0.5, 1), 't1': (0.7, 2), 'q1': (0.6, 3)}
+        for id in ranks:
+            self.trie.add('some', id, ranks[id])
+        node = self.trie.children['s'][1]
+
+        self.trie.top('some', 3, ranks.get)
+        self.trie.delete('some', 't1')
+        self.assertEqual(node.best, [(0.5, 1, 'u1'), (0.6, 3, 'q1')])
+
+        self.trie.top('some', 1, ranks.get)
+        self.trie.delete('some', 'q1')
+        self.assertEqual(node.best, [(0.5, 1, 'u1')])
+        self.assertEqual(
+            self.trie.top('some', 1, ranks.get), [(0.5, 1, 'u1')]
+        )
+
+    def test_top_slack(self):
+        """Best-top_k lists keep up to top_k extra entries, and are only
+        dropped once deletes use them all up.
+        """
+        ranks = dict(('u{}'.format(i), (i, i)) for i in range(5))
+        for id in ranks:
+            self.trie.add('some', id, ranks[id])
+        node = self.trie.children['s'][1]
+
+        self.trie.top('some', 1, ranks.get)
+        self.assertEqual(node.best, [(3, 3, 'u3'), (4, 4, 'u4')])
+        self.trie.delete('some', 'u4')
+        self.assertEqual(
+            self.trie.top('some', 1, ranks.get), [(3, 3, 'u3')]
+        )
+        self.trie.delete('some', 'u3')
+        self.assertIsNone(node.best)
+        self.assertEqual(
+            self.trie.top('some', 1, ranks.get), [(2, 2, 'u2')]
+        )
+
+    def test_top_missing_prefix(self):
+        """Top returns an empty list for prefixes not in the Trie."""
+        self.trie.add('some', 'u1', (0.5, 1))
+        self.assertEqual(self.trie.top('day', 2, None), [])
+        self.assertEqual(self.trie.top('', 2, None), [])
+
+    def test_spill(self):
+        """Large sets of entries are spilled to the store and brought back
+        once they shrink.
+        """
+        store = PostingStore(spill_size=2)
+        self.addCleanup(store.close)
+        trie = TypeAheadRadixTrie(store=store)
+        for id in ('u1', 't1', 'q1'):
+            trie.add('some', id)
+        trie.add('someday', 'b1')
+
+        node = trie.children['s'][1]
+        self.assertIsInstance(node.entries, SpilledPostings)
+        self.assertIsInstance(node.children['d'][1].entries, set)
+        self.assertEqual(set(trie.search('so')), set(['u1', 't1', 'q1', 'b1']))
+
+        trie.delete('some', 'u1')
+        trie.delete('some', 't1')
+        self.assertIsInstance(node.entries, SpilledPostings)
+        trie.delete('some', 'q1')
+        self.assertEqual(node.entries, set(['b1']))
+        self.assertIsInstance(node.entries, set)
+
+    def test_spill_split(self):
+        """Nodes split from a spilled node share its run."""
+        store = PostingStore(spill_size=1)
+        self.addCleanup(store.close)
+        trie = TypeAheadRadixTrie(store=store)
+        trie.add('somebody', 'u1')
+        trie.add('somebody', 't1')
+        trie.add('someday', 'q1')
+
+        node = trie.children['s'][1]
+        self.assertEqual(set(node.entries), set(['u1', 't1', 'q1']))
+        self.assertEqual(
+            set(node.children['b'][1].entries), set(['u1', 't1'])
+        )
+        self.assertEqual(node.children['d'][1].entries, set(['q1']))
+
+    def test_search_all(self):
+        """Search all returns the entries represented by every prefix."""
+        self.trie.add('some', self.ids[0])
+        self.trie.add('day', self.ids[0])
+        self.trie.add('some', self.ids[1])
+        self.assertEqual(self.trie.search_all(['so']), set(self.ids))
+        self.assertEqual(
+            self.trie.search_all(['so', 'd']), set([self.ids[0]])
+        )
+        self.assertEqual(
+            self.trie.search_all(['d', 'so']), set([self.ids[0]])
+        )
+        self.assertEqual(self.trie.search_all(['so', 'x', 'd']), set())
+
+
+class TestTypePartitionedTrie(unittest.TestCase):
+    def setUp(self):
+        self.trie = TypePartitionedTrie()
+        self.trie.add('user', 'some', 'u1', (0.5, 1))
+        self.trie.add('topic', 'some', 't1', (0.7, 2))
+        self.trie.add('topic', 'day', 't1', (0.7, 2))
+        self.trie.add('topic', 'sum', 't2', (0.6, 3))
+
+    def test_partitions(self):
+        """Entries are stored in the Trie for their type."""
+        self.assertEqual(set(self.trie.tries), set(['user', 'topic']))
+        self.assertIn('day', self.trie.tries['topic'])
+        self.assertNotIn('day', self.trie.tries['user'])
+        self.assertIn('day', self.trie)
+        self.assertEqual(len(self.trie.partitions()), 2)
+        self.assertEqual(len(self.trie.partitions(['user', 'board'])), 1)
+
+    def test_search(self):
+        """Searches cover only the types asked for."""
+        self.assertEqual(self.trie.search('so'), set(['u1', 't1']))
+        self.assertEqual(self.trie.search('so', ['user']), set(['u1']))
+        self.assertEqual(self.trie.search('so', ['board']), set())
+
+    def test_search_all(self):
+        """Search all returns one nonempty set per type."""
+        self.assertEqual(
+            sorted(map(sorted, self.trie.search_all(['s']))),
+            [['t1', 't2'], ['u1']]
+        )
+        self.assertEqual(self.trie.search_all(['s', 'd']), [set(['t1'])])
+        self.assertEqual(self.trie.search_all(['s'], ['board']), [])
+
+    def test_top(self):
+        """Best lists of each type are merged."""
+        ranks = {'u1': (0.5, 1), 't1': (0.7, 2), 't2': (0.6, 3)}
+        self.assertEqual(
+            self.trie.top('s', 2, ranks.get),
+            [(0.7, 2, 't1'), (0.6, 3, 't2')]
+        )
+        self.assertEqual(
+            self.trie.top('s', 2, ranks.get, ['user']), [(0.5, 1, 'u1')]
+        )
+
+    def test_fuzzy_search(self):
+        """Fuzzy searches cover only the types asked for."""
+        self.assertEqual(self.trie.fuzzy_search('sime', 1), set(['u1', 't1']))
+        self.assertEqual(
+            self.trie.fuzzy_search('sime', 1, types=['topic']), set(['t1'])
+        )
+        self.assertEqual(self.trie.fuzzy_search('sime', 1, 0), set())
+
+    def test_delete(self):
+        """Deleting removes entries from the Trie for their type."""
+        self.trie.delete('topic', 'some', 't1')
+        self.assertEqual(self.trie.search('so'), set(['u1']))
+
+
+class TestUnpartitionedTrie(unittest.TestCase):
+    def setUp(self):
+        self.trie = TypePartitionedTrie(partitioned=False)
+        self.trie.add('user', 'some', 'u1', (0.5, 1))
+        self.trie.add('topic', 'some', 't1', (0.7, 2))
+
+    def test_single_trie(self):
+        """Every type is stored in the same Trie."""
+        self.assertEqual(list(self.trie.tries), [None])
+        self.assertEqual(self.trie.search('so'), set(['u1', 't1']))
+        self.trie.delete('topic', 'some', 't1')
+        self.assertEqual(self.trie.search('so'), set(['u1']))
+
+    def test_types(self):
+        """Searches can't be limited to some types."""
+        self.assertRaises(ValueError, self.trie.search, 'so', ['user'])
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,5 +1,11 @@
+import os
+import sys
+import cPickle
 import unittest
-from search import TypeAheadSearchSession
+import tempfile
+from StringIO import StringIO
+from search import TypeAheadSearchSession, main
+from postings import PostingStore
 
 
 class TestAddDeleteCommands(unittest.TestCase):
@@ -142,6 +148,23 @@ class TestQueryCommand(unittest.TestCase):
         result = self.search.query("10 this uest")
         self.assertEqual(len(result), 0)
 
+    def test_query_term_order(self):
+        """The order of search terms doesn't change the results."""
+        self.search.add("question q2 0.5 This is another question.")
+        self.search.add("user u2 0.4 This Oscar")
+        for terms in ("this is", "is this", "is ques this", "this ques is"):
+            result = self.search.query("10 " + terms)
+            self.assertEqual(
+                result,
+                [self.search.entries['q2'], self.search.entries['q1']]
+            )
+
+    def test_query_empty_term(self):
+        """A term with no results empties the results of the others."""
+        self.search.add("question q2 0.5 This is another question.")
+        self.assertEqual(self.search.query("10 this is x"), [])
+        self.assertEqual(self.search.query("10 x this is"), [])
+
     def test_query_retrieve_multiple_results(self):
         """Retrieve multiple results, in the correct order."""
         self.search.add("question q2 0.5 This is another question.")
@@ -233,5 +256,273 @@ class TestWqueryCommand(unittest.TestCase):
         self.assertEqual(self.search.entries['q3'], result[0])
         self.assertEqual(self.search.entries['q2'], result[1])
 
+
+class TestTqueryCommand(unittest.TestCase):
+    """Test the tquery method of the search session class."""
+
+    partition_types = False
+
+    def setUp(self):
+        self.search = TypeAheadSearchSession(
+            partition_types=self.partition_types
+        )
+        self.search.add("question q1 0.3 This is a question.")
+        self.search.add("question q2 0.6 This is another question.")
+        self.search.add("topic t1 0.4 Questions")
+        self.search.add("user u1 0.5 Question Questionson")
+
+    def test_single_type(self):
+        """Only entries of the given type are retrieved."""
+        result = self.search.tquery("10 question question")
+        self.assertEqual(
+            result, [self.search.entries['q2'], self.search.entries['q1']]
+        )
+
+    def test_multiple_types(self):
+        """Entries of several types are merged in order."""
+        result = self.search.tquery("10 topic,user question")
+        self.assertEqual(
+            result, [self.search.entries['u1'], self.search.entries['t1']]
+        )
+        result = self.search.tquery("1 topic,user,topic question")
+        self.assertEqual(result, [self.search.entries['u1']])
+
+    def test_matches_filtered_query(self):
+        """Tquery returns the query results of the given types."""
+        for types in ("question", "user,topic", "board"):
+            expected = [
+                entry for entry in self.search.query("10 q")
+                if entry[0] in types.split(',')
+            ]
+            self.assertEqual(
+                self.search.run_command("TQUERY 10 {} q".format(types)),
+                expected
+            )
+
+    def test_top_k(self):
+        """Tquery uses the best lists when it can."""
+        self.search.top_k = 2
+        self.assertEqual(
+            self.search.tquery("2 question,topic q"),
+            [self.search.entries['q2'], self.search.entries['t1']]
+        )
+
+
+class TestPartitionedTqueryCommand(TestTqueryCommand):
+    """Test the tquery method with a Trie per type."""
+
+    partition_types = True
+
+    def test_partitions(self):
+        """Each type is stored in its own Trie."""
+        self.assertEqual(
+            set(self.search.trie.tries), set(['question', 'topic', 'user'])
+        )
+
+    def test_wquery(self):
+        """Wquery ranks and merges the results of each type."""
+        plain = TypeAheadSearchSession()
+        for entry in sorted(self.search.entries.values(), key=lambda e: e[4]):
+            plain.add(' '.join(map(str, entry[:4])))
+        for command in ("WQUERY 3 1 topic:2 q", "WQUERY 2 2 user:0.1 q1:3 q"):
+            self.assertEqual(
+                self.search.run_command(command), plain.run_command(command)
+            )
+
+
+class TestTopKQuery(unittest.TestCase):
+    """Test queries answered from the best-top_k lists."""
+
+    def setUp(self):
+        self.search = TypeAheadSearchSession(top_k=2)
+        self.plain = TypeAheadSearchSession()
+        self.run_both("ADD question q1 0.3 This is a question.")
+        self.run_both("ADD question q2 0.6 This is another question.")
+        self.run_both("ADD question q3 0.4 This is a third question.")
+        self.run_both("ADD user u1 0.5 Question Questionson")
+
+    def run_both(self, command):
+        result = self.search.run_command(command)
+        self.assertEqual(result, self.plain.run_command(command))
+        return result
+
+    def test_query(self):
+        """Short single word queries match the full ranking."""
+        for command in ("QUERY 1 q", "QUERY 2 q", "QUERY 2 thi", "QUERY 2 x"):
+            self.run_both(command)
+
+    def test_query_after_add_and_delete(self):
+        """Best-top_k lists follow adds and deletes."""
+        self.run_both("QUERY 2 q")
+        self.run_both("ADD topic t1 0.9 Quarks")
+        self.assertEqual(
+            self.run_both("QUERY 2 q"),
+            [self.search.entries['t1'], self.search.entries['q2']]
+        )
+        self.run_both("DEL t1")
+        self.run_both("DEL q2")
+        self.assertEqual(
+            self.run_both("QUERY 2 q"),
+            [self.search.entries['u1'], self.search.entries['q3']]
+        )
+
+    def test_delete_best_without_rebuild(self):
+        """Deleting the best entries between queries uses up the slack in
+        the best-top_k lists before they are rebuilt.
+        """
+        for i, score in enumerate((0.1, 0.2, 0.7, 0.8), 4):
+            self.run_both("ADD question q{} {} Question {}".format(
+                i, score, i
+            ))
+        ranked = []
+        rank = self.search._rank
+        self.search._rank = lambda id: ranked.append(id) or rank(id)
+
+        self.run_both("QUERY 2 q")
+        built = len(ranked)
+        for id in ('q7', 'q6'):
+            self.run_both("DEL " + id)
+            self.run_both("QUERY 2 q")
+        self.assertEqual(len(ranked), built)
+
+        self.run_both("DEL q2")
+        self.run_both("QUERY 2 q")
+        self.assertGreater(len(ranked), built)
+
+    def test_query_fallback(self):
+        """Long, multi word and large queries are still answered."""
+        for command in ("QUERY 3 q", "QUERY 2 question", "QUERY 2 is a"):
+            self.run_both(command)
+
+
+class TestSnapshot(unittest.TestCase):
+    """Test seeding sessions from snapshots."""
+
+    def setUp(self):
+        self.search = TypeAheadSearchSession(top_k=2)
+        self.search.add("question q1 0.3 This is a question.")
+        self.search.add("user u1 0.5 Question Questionson")
+        self.search.query("2 q")
+
+    def test_dump_load(self):
+        """A loaded snapshot answers queries like the original session."""
+        snapshot = StringIO()
+        self.search.dump(snapshot)
+        snapshot.seek(0)
+        search = TypeAheadSearchSession.load(snapshot)
+
+        for command in ("QUERY 2 q", "QUERY 10 this", "WQUERY 2 1 q1:5 q"):
+            self.assertEqual(
+                search.run_command(command),
+                self.search.run_command(command)
+            )
+        search.add("topic t1 0.9 Quarks")
+        self.assertEqual(search.added, 3)
+        self.assertEqual(search.query("1 q"), [search.entries['t1']])
+
+    def test_dump_deep_trie(self):
+        """Tries deeper than the recursion limit allows for can be dumped,
+        and the limit is restored afterwards.
+        """
+        search = TypeAheadSearchSession()
+        for depth in range(1, 301):
+            search.add("user u{} 0.1 {}".format(depth, 'a' * depth))
+        limit = sys.getrecursionlimit()
+        snapshot = StringIO()
+        search.dump(snapshot)
+        self.assertEqual(sys.getrecursionlimit(), limit)
+
+        snapshot.seek(0)
+        search = TypeAheadSearchSession.load(snapshot)
+        self.assertEqual(
+            [entry[1] for entry in search.query("2 " + 'a' * 299)],
+            ['u300', 'u299']
+        )
+
+    def test_main_package_snapshot(self):
+        """Snapshots dumped through the package load through main."""
+        sys.path.insert(0, os.path.dirname(os.path.dirname(
+            os.path.abspath(__file__)
+        )))
+        self.addCleanup(sys.path.pop, 0)
+        from typeahead_search.search import (
+            TypeAheadSearchSession as PackageSession
+        )
+        search = PackageSession()
+        search.add("user u1 0.5 Question Questionson")
+
+        fd, path = tempfile.mkstemp()
+        self.addCleanup(os.remove, path)
+        with os.fdopen(fd, 'wb') as snapshot:
+            search.dump(snapshot)
+
+        stdin, stdout = sys.stdin, sys.stdout
+        sys.stdin = StringIO("1\nQUERY 10 q\n")
+        sys.stdout = StringIO()
+        try:
+            main(path)
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdin, sys.stdout = stdin, stdout
+        self.assertEqual(output, "u1\n")
+
+    def test_load_wrong_type(self):
+        """Loading a snapshot of something else fails."""
+        snapshot = StringIO()
+        cPickle.dump({}, snapshot)
+        snapshot.seek(0)
+        self.assertRaises(ValueError, TypeAheadSearchSession.load, snapshot)
+
+    def test_main_snapshot(self):
+        """Main seeds its session from a snapshot path."""
+        fd, path = tempfile.mkstemp()
+        self.addCleanup(os.remove, path)
+        with os.fdopen(fd, 'wb') as snapshot:
+            self.search.dump(snapshot)
+
+        stdin, stdout = sys.stdin, sys.stdout
+        sys.stdin = StringIO("2\nADD topic t1 0.1 Quiet\nQUERY 10 q\n")
+        sys.stdout = StringIO()
+        try:
+            main(path)
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdin, sys.stdout = stdin, stdout
+        self.assertEqual(output, "u1 q1 t1\n")
+
+
+class TestSpilledQuery(unittest.TestCase):
+    """Test queries against a session spilling entries to disk."""
+
+    def setUp(self):
+        store = PostingStore(cache_bytes=0, spill_size=1)
+        self.addCleanup(store.close)
+        self.search = TypeAheadSearchSession(top_k=2, store=store)
+        self.plain = TypeAheadSearchSession()
+        for command in (
+            "ADD question q1 0.3 This is a question.",
+            "ADD question q2 0.6 This is another question.",
+            "ADD question q3 0.4 This is a third question.",
+            "ADD user u1 0.5 Question Questionson",
+            "DEL q2",
+        ):
+            self.search.run_command(command)
+            self.plain.run_command(command)
+
+    def test_dump(self):
+        """Sessions spilling to a store can't be snapshotted."""
+        self.assertRaises(TypeError, self.search.dump, StringIO())
+
+    def test_queries(self):
+        """Queries match those of a session keeping entries in memory."""
+        for command in (
+            "QUERY 10 q", "QUERY 2 q", "QUERY 10 this question",
+            "QUERY 10 is x", "WQUERY 10 1 user:0.1 question",
+        ):
+            self.assertEqual(
+                self.search.run_command(command),
+                self.plain.run_command(command)
+            )
+
 if __name__ == '__main__':
     unittest.main()